@@ -5,7 +5,7 @@ pwgen.py — детерминированный генератор крипто
 зашифрованным хранилищем. Алгоритм: Argon2id -> HKDF -> ChaCha20 DRBG -> rejection sampling.
 
 Команды:
-  INIT ВОЛЬТА:      python pwgen.py init
+  INIT ВОЛЬТА:      python pwgen.py init [--auto-tune --target-ms 500]
   ДОБАВИТЬ САЙТ:    python pwgen.py add --site example.com --login you@mail.com [--profile strict]
   ПОЛУЧИТЬ ПАРОЛЬ:  python pwgen.py get --site example.com --login you@mail.com [--copy]
   РОТАЦИЯ:          python pwgen.py rotate --site example.com --login you@mail.com [--mode counter|rseed]
@@ -16,8 +16,9 @@ pwgen.py — детерминированный генератор крипто
 Python 3.10+
 """
 
-import argparse, base64, json, os, sys, time, getpass, hmac, hashlib, secrets, binascii
+import argparse, json, os, sys, time, getpass, hmac, hashlib, secrets, binascii, struct
 from datetime import datetime, timezone
+from functools import lru_cache
 from typing import Dict, Any, Tuple, Optional, Iterable
 
 # --- внешние библиотеки ---
@@ -29,48 +30,84 @@ except Exception:
     Cipher = None
     algorithms = None
 
-# tldextract опционален
+# orjson — быстрый (де)сериализатор JSON для вольта (необязательно)
 try:
-    import tldextract
-    _HAS_TLDEXTRACT = True
+    import orjson
+    _HAS_ORJSON = True
 except Exception:
-    _HAS_TLDEXTRACT = False
+    _HAS_ORJSON = False
 
-# pyperclip для --copy (необязательно)
-try:
-    import pyperclip
-    _HAS_PYPERCLIP = True
-except Exception:
-    _HAS_PYPERCLIP = False
+# tldextract, pyperclip — необязательные и грузятся лениво при первом использовании:
+# их импорт стоит от десятков до сотен мс, а большинству команд они не нужны.
+_TLDEXTRACT = None   # модуль, False — недоступен, None — ещё не проверяли
+
+def _tldextract():
+    global _TLDEXTRACT
+    if _TLDEXTRACT is None:
+        try:
+            import tldextract
+            _TLDEXTRACT = tldextract
+        except Exception:
+            _TLDEXTRACT = False
+    return _TLDEXTRACT
 
 # --------------- УТИЛИТЫ ---------------
 
+# urlsafe-base64 напрямую через binascii (формат тот же, что у base64.urlsafe_b64*)
+_B64_TO_URLSAFE = bytes.maketrans(b"+/", b"-_")
+_B64_FROM_URLSAFE = bytes.maketrans(b"-_", b"+/")
+
 def b64e(b: bytes) -> str:
-    return base64.urlsafe_b64encode(b).decode('ascii')
+    return binascii.b2a_base64(b, newline=False).translate(_B64_TO_URLSAFE).decode('ascii')
 
 def b64d(s: str) -> bytes:
-    return base64.urlsafe_b64decode(s.encode('ascii'))
+    return binascii.a2b_base64(s.encode('ascii').translate(_B64_FROM_URLSAFE))
+
+def json_dumps_bytes(obj: Any) -> bytes:
+    """Компактный UTF-8 JSON (orjson, если есть)."""
+    if _HAS_ORJSON:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',',':')).encode('utf-8')
+
+def json_loads(data: bytes) -> Any:
+    if _HAS_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
 
 def now_iso() -> str:
     return datetime.now(timezone.utc).replace(microsecond=0).isoformat()
 
+def random_bytes(n: int) -> bytes:
+    # Один системный вызов getrandom(2) на Linux, иначе os.urandom
+    if hasattr(os, "getrandom"):
+        buf = b""
+        while len(buf) < n:
+            buf += os.getrandom(n - len(buf))
+        return buf
+    return os.urandom(n)
+
 def sha256(data: bytes) -> bytes:
     return hashlib.sha256(data).digest()
 
 def sha512_256(data: bytes) -> bytes:
     return hashlib.sha512(data).digest()[:32]
 
+_SHA512_DIGEST_SIZE = 64
+_EMPTY_SALT_SHA512 = b"\x00" * _SHA512_DIGEST_SIZE
+
+# HKDF на SHA-512 вызывается пару раз на генерацию (микросекунды на фоне Argon2),
+# поэтому переход на SHA-256 ради SHA-NI не стоит новой версии алгоритма.
+# hmac.digest — однопроходный C-путь OpenSSL без создания HMAC-объекта.
 def hkdf_expand_sha512(prk: bytes, info: bytes, L: int) -> bytes:
     # Simplified HKDF-Expand for single-block outputs (L <= 64)
-    digest_len = hashlib.sha512().digest_size
-    if L > digest_len:
+    if L > _SHA512_DIGEST_SIZE:
         raise ValueError("Requested HKDF length exceeds SHA-512 digest size")
-    return hmac.new(prk, info + b"\x01", hashlib.sha512).digest()[:L]
+    return hmac.digest(prk, info + b"\x01", "sha512")[:L]
 
 def hkdf_extract_sha512(salt: bytes, ikm: bytes, L: int = 32) -> bytes:
     if not salt:
-        salt = b"\x00" * hashlib.sha512().digest_size
-    return hmac.new(salt, ikm, hashlib.sha512).digest()[:L]
+        salt = _EMPTY_SALT_SHA512
+    return hmac.digest(salt, ikm, "sha512")[:L]
 
 def to_punycode(host: str) -> str:
     try:
@@ -80,7 +117,8 @@ def to_punycode(host: str) -> str:
 
 def etld_plus_one(host: str) -> str:
     host = to_punycode(host)
-    if _HAS_TLDEXTRACT:
+    tldextract = _tldextract()
+    if tldextract:
         ext = tldextract.extract(host)
         if ext.domain and ext.suffix:
             return f"{ext.domain}.{ext.suffix}".lower()
@@ -110,9 +148,17 @@ DEFAULT_VAULT = os.path.expanduser("~/.pwgen_vault.json")
 DEFAULT_KDF_T = 3
 DEFAULT_KDF_M = 131072  # KiB = 128 MiB
 DEFAULT_KDF_P = 1
-ALGO_VERSION = "sha512-v1"  # смените при миграциях
+# Argon2id для вывода паролей сайтов (sha512-v2+). Перебор мастер-фразы по утёкшему паролю
+# всё равно требует капсулу из вольта, поэтому хватает параметров легче вольтовых.
+# Параметры сохраняются в записи ("kdf"); записи без них выводятся с DEFAULT_KDF_*.
+DERIV_KDF_T = 1
+DERIV_KDF_M = 32768  # KiB = 32 MiB
+DERIV_KDF_P = 1
+ALGO_VERSION = "sha512-v2"  # смените при миграциях
+
+LEGACY_ALGO_VERSION = "sha512-v1"  # записи без поля "v" созданы этой версией
 
-SUPPORTED_ALGO_VERSIONS = {ALGO_VERSION}
+SUPPORTED_ALGO_VERSIONS = {LEGACY_ALGO_VERSION, ALGO_VERSION}
 
 # Наборы символов
 CLASSES = {
@@ -142,45 +188,95 @@ def kdf_argon2id(master: str, salt: bytes, t: int, m: int, p: int) -> bytes:
                            salt=salt, time_cost=t, memory_cost=m,
                            parallelism=p, hash_len=32, type=Argon2Type.ID)
 
-def vault_encrypt(plaintext: bytes, master: str,
-                  t: int, m: int, p: int) -> Dict[str, Any]:
-    salt = os.urandom(16)
-    key  = kdf_argon2id(master, salt, t, m, p)
-    nonce = os.urandom(12)
-    aead = ChaCha20Poly1305(key)
-    ct = aead.encrypt(nonce, plaintext, b"pwgen|vault|v1")
+KDF_TUNE_MIN_M = 65536     # KiB = 64 MiB, ниже автоподбор не опускается
+KDF_TUNE_MAX_M = 1048576   # KiB = 1 GiB
+
+def calibrate_kdf(target_ms: float, p: int = DEFAULT_KDF_P) -> Tuple[int, int, int]:
+    """
+    Подбирает (t, m, p) для Argon2id вольта так, чтобы вывод ключа занимал ~target_ms на этой машине.
+    Время Argon2 примерно линейно по t*m: меряем один проход на KDF_TUNE_MIN_M, сначала растим память, потом t.
+    """
+    probe_m = KDF_TUNE_MIN_M
+    start = time.perf_counter()
+    kdf_argon2id("benchmark", b"\x00"*16, 1, probe_m, p)
+    elapsed_ms = max((time.perf_counter() - start) * 1000.0, 1e-3)
+    budget = probe_m * target_ms / elapsed_ms  # KiB * проходы
+    m = int(min(max(budget, KDF_TUNE_MIN_M), KDF_TUNE_MAX_M))
+    m -= m % 1024
+    t = max(1, int(budget // m))
+    return t, m, p
+
+_VAULT_AAD = b"pwgen|vault|v1"
+
+def vault_seal(plaintext: bytes, key: bytes, kdf: Dict[str, Any]) -> Dict[str, Any]:
+    """Зашифровать уже выведенным ключом; kdf (вместе с солью) описывает, как этот ключ получен."""
+    nonce = random_bytes(12)
+    ct = ChaCha20Poly1305(key).encrypt(nonce, plaintext, _VAULT_AAD)
     return {
         "version": "pwgen_vault_v1",
-        "kdf": {"alg":"argon2id","t":t,"m":m,"p":p,"salt": b64e(salt)},
+        "kdf": dict(kdf),
         "aead": {"alg":"chacha20poly1305","nonce": b64e(nonce)},
         "ciphertext": b64e(ct),
         "written_at": now_iso(),
     }
 
-def vault_decrypt(blob: Dict[str, Any], master: str) -> bytes:
+def vault_new_key(master: str, t: int, m: int, p: int) -> Tuple[bytes, Dict[str, Any]]:
+    """Новая соль и ключ вольта; вернёт (key, kdf) для vault_seal."""
+    salt = random_bytes(16)
+    key  = kdf_argon2id(master, salt, t, m, p)
+    return key, {"alg":"argon2id","t":t,"m":m,"p":p,"salt": b64e(salt)}
+
+def vault_encrypt(plaintext: bytes, master: str,
+                  t: int, m: int, p: int) -> Dict[str, Any]:
+    key, kdf = vault_new_key(master, t, m, p)
+    return vault_seal(plaintext, key, kdf)
+
+def vault_key(blob: Dict[str, Any], master: str) -> bytes:
+    """Argon2id-ключ вольта — дорогая часть vault_decrypt."""
     if blob.get("version") != "pwgen_vault_v1":
         raise ValueError("Unsupported vault version")
-    kdf = blob["kdf"]; aead = blob["aead"]
-    salt = b64d(kdf["salt"])
-    key  = kdf_argon2id(master, salt, int(kdf["t"]), int(kdf["m"]), int(kdf["p"]))
-    nonce = b64d(aead["nonce"])
+    kdf = blob["kdf"]
+    return kdf_argon2id(master, b64d(kdf["salt"]), int(kdf["t"]), int(kdf["m"]), int(kdf["p"]))
+
+def vault_open(blob: Dict[str, Any], key: bytes) -> bytes:
+    if blob.get("version") != "pwgen_vault_v1":
+        raise ValueError("Unsupported vault version")
+    nonce = b64d(blob["aead"]["nonce"])
     ct    = b64d(blob["ciphertext"])
-    a = ChaCha20Poly1305(key)
-    return a.decrypt(nonce, ct, b"pwgen|vault|v1")
+    return ChaCha20Poly1305(key).decrypt(nonce, ct, _VAULT_AAD)
+
+def vault_decrypt(blob: Dict[str, Any], master: str) -> bytes:
+    return vault_open(blob, vault_key(blob, master))
 
 def vault_load(path: str) -> Dict[str, Any]:
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    with open(path, "rb") as f:
+        return json_loads(f.read())
 
-def vault_save(path: str, blob: Dict[str, Any]) -> None:
+def vault_save(path: str, blob: Dict[str, Any]) -> os.stat_result:
+    """Атомарная запись; вернёт stat записанного файла (os.replace сохраняет inode и mtime)."""
     tmp = path + ".tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(blob, f, ensure_ascii=False, indent=2)
+    with open(tmp, "wb") as f:
+        f.write(json_dumps_bytes(blob))
+        f.flush()
+        os.fsync(f.fileno())   # иначе после сбоя os.replace может оставить пустой вольт
+        st = os.fstat(f.fileno())
     os.replace(tmp, path)
+    try:
+        dfd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        dfd = None
+    if dfd is not None:
+        try:
+            os.fsync(dfd)      # закрепить сам rename
+        except OSError:
+            pass
+        finally:
+            os.close(dfd)
     try:
         os.chmod(path, 0o600)
     except Exception:
         pass
+    return st
 
 # --------------- СТРУКТУРА ПЛЕЙНТЕКСТА ---------------
 
@@ -195,127 +291,256 @@ def make_empty_plaintext(capsule_b64: str) -> Dict[str, Any]:
 
 def read_plaintext(vault_path: str, master: str) -> Dict[str, Any]:
     blob = vault_load(vault_path)
-    pt = vault_decrypt(blob, master)
-    return json.loads(pt.decode('utf-8'))
+    return json_loads(vault_decrypt(blob, master))
 
 def write_plaintext(vault_path: str, master: str, data: Dict[str, Any],
                     t:int, m:int, p:int) -> None:
     data["updated"] = now_iso()
-    blob = vault_encrypt(json.dumps(data, ensure_ascii=False, separators=(',',':')).encode('utf-8'),
-                         master, t, m, p)
+    blob = vault_encrypt(json_dumps_bytes(data), master, t, m, p)
     vault_save(vault_path, blob)
 
+def rewrite_plaintext(vault_path: str, key: bytes, kdf: Dict[str, Any],
+                      data: Dict[str, Any]) -> Tuple[Dict[str, Any], os.stat_result]:
+    """Как write_plaintext, но с уже известным ключом и солью вольта (без Argon2); новый nonce.
+    Вернёт (blob, stat записанного файла)."""
+    data["updated"] = now_iso()
+    blob = vault_seal(json_dumps_bytes(data), key, kdf)
+    return blob, vault_save(vault_path, blob)
+
 # --------------- DRBG (ChaCha20 stream) ---------------
 
-def chacha20_stream(key: bytes, nonce: bytes = b"\x00"*16) -> iter:
+class ChaChaDRBG:
     """
-    Поток байт на ChaCha20. Основной путь — algorithms.ChaCha20 (nonce=16B, mode=None).
+    Буферизованный поток байт на ChaCha20. Основной путь — algorithms.ChaCha20 (nonce=16B, mode=None).
     Фоллбек — ChaCha20-Poly1305 с УНИКАЛЬНЫМ 12B nonce на каждый блок (без повторного использования nonce).
+    Ключевой поток тянется пачками по 16 блоков (1 KiB), выдача — через read(n).
     """
-    if Cipher is not None and algorithms is not None:
-        # cryptography: ChaCha20 с 16-байтным nonce, режим = None
-        cipher = Cipher(algorithms.ChaCha20(key, nonce), mode=None)
-        enc = cipher.encryptor()
-        while True:
-            block = enc.update(b"\x00" * 64)
-            for b in block:
-                yield b
-    else:
-        # Фоллбек: ChaCha20-Poly1305, меняем nonce на каждом блоке (12 байт)
-        aead = ChaCha20Poly1305(key)
-        counter = 0
+    _BLOCKS = 16
+    _ZEROS = bytes(64 * _BLOCKS)
+    _ZERO_BLOCK = bytes(64)
+    _AAD = b"pwgen|drbg"
+
+    def __init__(self, key: bytes, nonce: bytes = b"\x00"*16):
+        if Cipher is not None and algorithms is not None:
+            # cryptography: ChaCha20 с 16-байтным nonce, режим = None
+            self._enc = Cipher(algorithms.ChaCha20(key, nonce), mode=None).encryptor()
+            self._aead = None
+        else:
+            # Фоллбек: ChaCha20-Poly1305, меняем nonce на каждом блоке (12 байт)
+            self._enc = None
+            self._aead = ChaCha20Poly1305(key)
+            self._nonce12 = bytearray(nonce[:4] + bytes(8))
+            self._counter = 0
+        self._buf = b""
+        self._pos = 0
+
+    def _refill(self) -> bytes:
+        if self._enc is not None:
+            return self._enc.update(self._ZEROS)
+        # Тег Poly1305 остаётся в потоке: от него зависят уже выданные фоллбеком пароли
+        encrypt, n12, zeros, aad = self._aead.encrypt, self._nonce12, self._ZERO_BLOCK, self._AAD
+        parts = []
+        for counter in range(self._counter, self._counter + self._BLOCKS):
+            struct.pack_into(">Q", n12, 4, counter)  # 12-byte nonce
+            parts.append(encrypt(bytes(n12), zeros, aad))
+        self._counter += self._BLOCKS
+        return b"".join(parts)
+
+    def read(self, n: int) -> bytes:
+        buf, pos = self._buf, self._pos
+        if pos + n <= len(buf):
+            self._pos = pos + n
+            return buf[pos:pos + n]
+        out = [buf[pos:]]
+        need = n - (len(buf) - pos)
         while True:
-            n12 = nonce[:4] + counter.to_bytes(8, "big")  # 12-byte nonce
-            ct = aead.encrypt(n12, b"\x00" * 64, b"pwgen|drbg")
-            for b in ct:
-                yield b
-            counter += 1
-
-def rand_below(byte_iter: Iterable[int], n: int) -> int:
+            buf = self._refill()
+            if need <= len(buf):
+                out.append(buf[:need])
+                self._buf, self._pos = buf, need
+                return b"".join(out)
+            out.append(buf)
+            need -= len(buf)
+
+def chacha20_stream(key: bytes, nonce: bytes = b"\x00"*16) -> ChaChaDRBG:
+    return ChaChaDRBG(key, nonce)
+
+def rand_below(drbg: ChaChaDRBG, n: int) -> int:
     """Равномерное число из [0, n] включительно."""
     if n <= 0: return 0
+    limit = (1<<32) - ((1<<32) % (n+1))
     while True:
         # 32-битное значение
-        b0 = next(byte_iter); b1 = next(byte_iter); b2 = next(byte_iter); b3 = next(byte_iter)
-        val = (b0<<24)|(b1<<16)|(b2<<8)|b3
-        limit = (1<<32) - ((1<<32) % (n+1))
+        val = int.from_bytes(drbg.read(4), "big")
         if val < limit:
             return val % (n+1)
 
 def permute_list(items: list, key_for_perm: bytes) -> list:
-    it = chacha20_stream(key_for_perm, nonce=b"\x00"*16)
+    drbg = chacha20_stream(key_for_perm, nonce=b"\x00"*16)
     arr = list(items)
-    for i in range(len(arr)-1, 0, -1):
-        j = rand_below(it, i)
+    n = len(arr)
+    if n < 2:
+        return arr
+    # Fisher-Yates на тех же 32-битных выборках, что и rand_below: по одной на шаг
+    # вытягиваем пачкой, а редкие отказы дочитываются из потока по порядку.
+    words = iter(struct.unpack(f">{n-1}I", drbg.read(4*(n-1))))
+    for i in range(n-1, 0, -1):
+        limit = (1<<32) - ((1<<32) % (i+1))
+        for val in words:
+            if val < limit:
+                break
+        else:
+            val = limit
+            while val >= limit:
+                val = int.from_bytes(drbg.read(4), "big")
+        j = val % (i+1)
         arr[i], arr[j] = arr[j], arr[i]
     return arr
 
 # --------------- ПОЛИТИКИ/АЛФАВИТ ---------------
 
-def build_alphabet(policy: Dict[str, Any]) -> Tuple[list, list]:
+@lru_cache(maxsize=64)
+def _alphabet_cached(classes: tuple, forbid: tuple) -> Tuple[tuple, tuple]:
     allow = []
     required_sets = []
-    for cls in policy["classes"]:
+    for cls in classes:
         s = CLASSES[cls]
         allow += list(s)
-        required_sets.append(set(s))
-    for ch in policy.get("forbid", []):
+        required_sets.append(frozenset(s))
+    for ch in forbid:
         allow = [c for c in allow if c != ch]
     if not allow:
         raise ValueError("Пустой итоговый алфавит (проверьте forbid/classes)")
-    return allow, required_sets
+    return tuple(allow), tuple(required_sets)
+
+def build_alphabet(policy: Dict[str, Any]) -> Tuple[tuple, tuple]:
+    return _alphabet_cached(tuple(policy["classes"]), tuple(policy.get("forbid", [])))
 
-def satisfies_classes(pwd: str, required_sets: list) -> bool:
-    S = set(pwd)
+def satisfies_classes(pwd: str, required_sets: Iterable[frozenset]) -> bool:
+    # isdisjoint идёт по строке без построения set(pwd) и останавливается на первом совпадении
     for req in required_sets:
-        if not (S & req): return False
+        if req.isdisjoint(pwd): return False
     return True
 
+# Алфавиты стандартных профилей считаем при импорте
+for _policy in PROFILES.values():
+    build_alphabet(_policy)
+del _policy
+
 # --------------- ГЕНЕРАЦИЯ ПАРОЛЯ ---------------
 
-def gen_password(master: str, capsule: bytes, site_id: str, login: str,
-                 policy: Dict[str,Any], v: str, c: int, rseed: bytes) -> str:
-    if v not in SUPPORTED_ALGO_VERSIONS:
-        raise ValueError(f"Unsupported password derivation version: {v}")
-    # Контекст
-    context = (f"pwgen|{v}|{site_id}|{login}|{json.dumps(policy,sort_keys=True)}"
-               f"|c={c}|r={rseed.hex()}").encode('utf-8')
+# sha512-v1: счётчик c входит в соль Argon2 -> каждая попытка/ротация стоит полного Argon2.
+# sha512-v2: Argon2 зависит только от (site, login, policy, rseed), c подмешивается в HKDF-info,
+#            поэтому все попытки gen_password_with_retries делят один PRK.
+_LEGACY_ALGO_VERSIONS = {LEGACY_ALGO_VERSION}
+
+def _freeze(v: Any) -> tuple:
+    # Тип входит в ключ: 24 == 24.0 и 1 == True, но json.dumps пишет их по-разному
+    if isinstance(v, list):
+        return (list, tuple(_freeze(x) for x in v))
+    return (type(v), v)
 
+def _thaw(frozen: tuple) -> Any:
+    t, v = frozen
+    return [_thaw(x) for x in v] if t is list else v
+
+@lru_cache(maxsize=256)
+def _canon_policy_cached(frozen: tuple) -> str:
+    return json.dumps({k: _thaw(v) for k, v in frozen}, sort_keys=True)
+
+def canon_policy(policy: Dict[str,Any]) -> str:
+    """Канонический JSON политики (как json.dumps(policy, sort_keys=True)), с кэшем."""
+    try:
+        frozen = tuple((k, _freeze(v)) for k, v in policy.items())
+        return _canon_policy_cached(frozen)
+    except TypeError:
+        # нехешируемые значения — без кэша
+        return json.dumps(policy, sort_keys=True)
+
+def _password_context(site_id: str, login: str, policy_json: str,
+                      v: str, c: int, rseed: bytes) -> bytes:
+    if v in _LEGACY_ALGO_VERSIONS:
+        return (f"pwgen|{v}|{site_id}|{login}|{policy_json}"
+                f"|c={c}|r={rseed.hex()}").encode('utf-8')
+    return f"pwgen|{v}|{site_id}|{login}|{policy_json}|r={rseed.hex()}".encode('utf-8')
+
+def new_entry_kdf() -> Dict[str, int]:
+    """Параметры Argon2id для новых и ротированных записей."""
+    return {"t": DERIV_KDF_T, "m": DERIV_KDF_M, "p": DERIV_KDF_P}
+
+def _derive_prk(master: str, capsule: bytes, context: bytes,
+                kdf: Optional[Dict[str, Any]]) -> bytes:
+    # Ключ Argon2 вольта сюда не подходит: vault_encrypt берёт новую соль при каждой записи,
+    # и пароли, выведенные из него, менялись бы после любого add/rotate.
+    if kdf:
+        t, m, p = int(kdf["t"]), int(kdf["m"]), int(kdf["p"])
+    else:
+        t, m, p = DEFAULT_KDF_T, DEFAULT_KDF_M, DEFAULT_KDF_P
     base_salt = sha512_256(b"salt|" + context)
     prk = hash_secret_raw(secret=master.encode('utf-8'),
-                          salt=base_salt, time_cost=DEFAULT_KDF_T,
-                          memory_cost=DEFAULT_KDF_M, parallelism=DEFAULT_KDF_P,
+                          salt=base_salt, time_cost=t, memory_cost=m, parallelism=p,
                           hash_len=32, type=Argon2Type.ID)
     if capsule and len(capsule) >= 32:
         prk = hkdf_extract_sha512(salt=prk, ikm=capsule, L=32)
+    return prk
 
+def _finalize_password(prk: bytes, context: bytes, allow: tuple, L: int,
+                       shuffle: bool) -> str:
     Kpwd  = hkdf_expand_sha512(prk, b"password|" + context, 32)
     Kperm = hkdf_expand_sha512(prk, b"alphabet|" + context, 32)
 
-    allow, required_sets = build_alphabet(policy)
     A = permute_list(allow, Kperm)
 
-    L = int(policy["length"])
-    it = chacha20_stream(Kpwd, nonce=b"\x00"*16)
+    drbg = chacha20_stream(Kpwd, nonce=b"\x00"*16)
     M = len(A)
     T = (256 // M) * M
 
     out = []
     while len(out) < L:
-        b = next(it)
-        if b < T:
-            out.append(A[b % M])
+        out += [A[b % M] for b in drbg.read(64) if b < T]
+    del out[L:]
 
-    # Финальная перестановка позиций
-    out = permute_list(out, Kpwd)
+    # Финальная перестановка позиций (только sha512-v1). Символы и так i.i.d. равномерны на A,
+    # а перестановка i.i.d. выборки не меняет её распределение — в sha512-v2 шаг убран.
+    if shuffle:
+        out = permute_list(out, Kpwd)
     return "".join(out)
 
+def gen_password(master: str, capsule: bytes, site_id: str, login: str,
+                 policy: Dict[str,Any], v: str, c: int, rseed: bytes,
+                 kdf: Optional[Dict[str, Any]] = None) -> str:
+    if v not in SUPPORTED_ALGO_VERSIONS:
+        raise ValueError(f"Unsupported password derivation version: {v}")
+    policy_json = canon_policy(policy)
+    context = _password_context(site_id, login, policy_json, v, c, rseed)
+    prk = _derive_prk(master, capsule, context, kdf)
+    if v not in _LEGACY_ALGO_VERSIONS:
+        context += f"|c={c}".encode('utf-8')
+    allow, _ = build_alphabet(policy)
+    return _finalize_password(prk, context, allow, int(policy["length"]),
+                              shuffle=v in _LEGACY_ALGO_VERSIONS)
+
 def gen_password_with_retries(master: str, capsule: bytes, site_id: str, login: str,
                               policy: Dict[str,Any], v: str, c: int, rseed: bytes,
-                              max_tries: int = 8) -> Tuple[str, int]:
+                              max_tries: int = 8,
+                              kdf: Optional[Dict[str, Any]] = None) -> Tuple[str, int]:
+    if v not in SUPPORTED_ALGO_VERSIONS:
+        raise ValueError(f"Unsupported password derivation version: {v}")
+    # Всё, что не зависит от c, считаем один раз на вызов
     allow, required_sets = build_alphabet(policy)
+    policy_json = canon_policy(policy)
+    L = int(policy["length"])
+    legacy = v in _LEGACY_ALGO_VERSIONS
+    if not legacy:
+        base_context = _password_context(site_id, login, policy_json, v, c, rseed)
+        prk = _derive_prk(master, capsule, base_context, kdf)
     for i in range(max_tries):
-        pwd = gen_password(master, capsule, site_id, login, policy, v, c+i, rseed)
+        if legacy:
+            context = _password_context(site_id, login, policy_json, v, c+i, rseed)
+            prk = _derive_prk(master, capsule, context, kdf)
+        else:
+            context = base_context + f"|c={c+i}".encode('utf-8')
+        pwd = _finalize_password(prk, context, allow, L, shuffle=legacy)
         if satisfies_classes(pwd, required_sets):
             return pwd, (c+i)
     # крайне маловероятно, но если ни один не подошёл — вернём последний
@@ -324,7 +549,7 @@ def gen_password_with_retries(master: str, capsule: bytes, site_id: str, login:
 # --------------- КАПСУЛА ЭНТРОПИИ ---------------
 
 def make_capsule(extra_beacon: Optional[str] = None) -> bytes:
-    osrng = os.urandom(64)
+    osrng = random_bytes(64)
     jitter = int(time.time_ns()).to_bytes(8,'big') + os.getpid().to_bytes(4,'big', signed=False)
     ikm = osrng + jitter
     if extra_beacon:
@@ -344,11 +569,14 @@ def cmd_init(args):
     if master1 != master2 or not master1:
         print("Мастер-фразы не совпадают или пустые.")
         sys.exit(1)
+    t, m, p = args.time_cost, args.mem_cost, args.parallel
+    if args.auto_tune:
+        t, m, p = calibrate_kdf(args.target_ms, p)
+        print(f"Параметры Argon2id подобраны под ~{args.target_ms} мс: t={t}, m={m} KiB, p={p}")
     beacon = args.beacon or ""
     capsule = make_capsule(beacon)
     pt = make_empty_plaintext(b64e(capsule))
-    blob = vault_encrypt(json.dumps(pt, ensure_ascii=False).encode('utf-8'),
-                         master1, args.time_cost, args.mem_cost, args.parallel)
+    blob = vault_encrypt(json_dumps_bytes(pt), master1, t, m, p)
     vault_save(vp, blob)
     print(f"Готово. Вольт: {vp}")
 
@@ -358,7 +586,7 @@ def load_vault_pt(args) -> Tuple[Dict[str,Any], Dict[str,Any], str]:
         sys.exit(1)
     master = getpass.getpass("Мастер-фраза: ")
     blob = vault_load(args.vault)
-    pt = json.loads(vault_decrypt(blob, master).decode('utf-8'))
+    pt = json_loads(vault_decrypt(blob, master))
     return blob, pt, master
 
 def cmd_add(args):
@@ -381,13 +609,14 @@ def cmd_add(args):
         forbid = list(args.forbid) if args.forbid else ['"', "'", '`', ' ']
         policy = {"length": args.length, "classes": classes, "forbid": forbid}
 
-    rseed = os.urandom(16)
+    rseed = random_bytes(16)
     pt["sites"][key] = {
         "site_id": site_id,
         "login": login,
         "v": ALGO_VERSION,
         "c": 0,
         "rseed": rseed.hex(),
+        "kdf": new_entry_kdf(),
         "policy": policy,
         "created": now_iso(),
         "notes": args.notes or ""
@@ -418,19 +647,21 @@ def cmd_get(args):
         policy = policy.copy()
         policy["forbid"] = list(args.forbid)
 
-    version = entry.get("v", ALGO_VERSION)
+    version = entry.get("v", LEGACY_ALGO_VERSION)
     try:
         pwd, used_c = gen_password_with_retries(
             master, capsule, site_id, login, policy, version,
-            int(entry.get("c",0)), bytes.fromhex(entry["rseed"])
+            int(entry.get("c",0)), bytes.fromhex(entry["rseed"]),
+            kdf=entry.get("kdf")
         )
     except ValueError as exc:
         print(str(exc))
-        print("Rotate the entry to upgrade it to sha512-v1 before generating a password.")
+        print(f"Rotate the entry to upgrade it to {ALGO_VERSION} before generating a password.")
         sys.exit(1)
     print(pwd)
-    if _HAS_PYPERCLIP and args.copy:
+    if args.copy:
         try:
+            import pyperclip
             pyperclip.copy(pwd)
             print("(Пароль скопирован в буфер обмена)")
         except Exception:
@@ -453,13 +684,14 @@ def cmd_rotate(args):
         entry["c"] = int(entry.get("c",0)) + 1
         print(f"Новый c: {entry['c']}")
     elif mode == "rseed":
-        entry["rseed"] = os.urandom(16).hex()
+        entry["rseed"] = random_bytes(16).hex()
         entry["c"] = 0
         print("Генерация нового rseed и сброс c=0 выполнены.")
     else:
         print("Неизвестный режим ротации.")
         sys.exit(1)
     entry["v"] = ALGO_VERSION
+    entry["kdf"] = new_entry_kdf()
     pt["sites"][key] = entry
     write_plaintext(args.vault, master, pt,
                     blob["kdf"]["t"], blob["kdf"]["m"], blob["kdf"]["p"])
@@ -503,6 +735,9 @@ def build_parser():
     sp.add_argument("--time-cost", type=int, default=DEFAULT_KDF_T)
     sp.add_argument("--mem-cost",  type=int, default=DEFAULT_KDF_M, help="KiB (например 131072 = 128MiB)")
     sp.add_argument("--parallel",  type=int, default=DEFAULT_KDF_P)
+    sp.add_argument("--auto-tune", action="store_true",
+                    help="Подобрать t/m под эту машину (вместо --time-cost/--mem-cost)")
+    sp.add_argument("--target-ms", type=int, default=500, help="Целевое время вывода ключа для --auto-tune")
     sp.set_defaults(func=cmd_init)
 
     # add
@@ -14,17 +14,56 @@ pwgen_web.py — веб-интерфейс для детерминированн
 Переменные окружения для деплоя:
   PWGEN_WEB_SECRET   — Flask SECRET_KEY (опционально)
   PWGEN_VAULT_PATH   — путь к вольту, например /data/pwgen_vault.json
+  PWGEN_WEB_WORKERS  — число процессов gunicorn в Procfile (по умолчанию $WEB_CONCURRENCY или 2)
+  PWGEN_WEB_THREADS  — потоков на процесс (по умолчанию 2)
+  PWGEN_WEB_KDF_P    — дорожки Argon2 для нового вольта (по умолчанию доступные ядра
+                       / (WORKERS × THREADS), от 1 до 8)
+
+Память: каждый поток может держать свой Argon2 (m = 128 MiB по умолчанию), поэтому
+под KDF нужно до WORKERS × THREADS × 128 MiB — при умолчаниях 2 × 2 = 512 MiB сверх
+самого процесса. На дино с 512 MiB RAM ставьте PWGEN_WEB_THREADS=1 (256 MiB, как раньше).
+
+Прод-запуск — через gunicorn (см. Procfile), а не app.run(): Argon2 отпускает GIL,
+поэтому gthread-воркеры выполняют KDF параллельно на разных ядрах.
+
+Метрики (необязательно, нужен prometheus_client):
+  PWGEN_WEB_METRICS  — "1", чтобы открыть /metrics с гистограммой задержек index() по action;
+                       без него гистограмма не создаётся и не пишется
+  PROMETHEUS_MULTIPROC_DIR — пустой общий каталог для воркеров gunicorn. Без него /metrics
+                       показывает только воркер, которому достался scrape (у каждого
+                       процесса своя гистограмма); с ним — сумму MultiProcessCollector
+                       по всем воркерам. Каталог нужно очищать перед запуском gunicorn.
+  PWGEN_WEB_SLOW_MS  — порог предупреждения в лог о медленном запросе (по умолчанию 2500)
 
 Зависимости: Flask, pwgen.py (лежит рядом/в PYTHONPATH), всё остальное в стандартной библиотеке.
 """
 
+import copy
+import gzip
+import hashlib
+import hmac
 import json
 import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from operator import attrgetter
 from pathlib import Path
-from flask import Flask, flash, render_template_string, request, Response
+from typing import NamedTuple, Optional, Sequence
+from flask import Flask, flash, request, Response, session
+from markupsafe import Markup, escape
 
 import pwgen  # твой локальный модуль с логикой генерации/хранилища
 
+# prometheus_client — гистограмма задержек для /metrics (необязательно)
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Histogram, generate_latest, multiprocess
+    _HAS_PROMETHEUS = True
+except Exception:
+    _HAS_PROMETHEUS = False
+
 # ---------------------------------- App config ----------------------------------
 
 APP_NAME = "pwgen web"
@@ -32,9 +71,353 @@ APP_THEME_DARK = "#0b0f1a"
 APP_THEME_LIGHT = "#f5f7fb"
 
 app = Flask(__name__)
-app.config["SECRET_KEY"] = os.environ.get("PWGEN_WEB_SECRET", os.urandom(16).hex())
+app.config["SECRET_KEY"] = os.environ.get("PWGEN_WEB_SECRET") or os.urandom(32).hex()
+# Форма маленькая; Werkzeug отвечает 413 ещё до разбора тела
+app.config["MAX_CONTENT_LENGTH"] = 16 * 1024
+
+def _env_number(name: str, default, conv=int):
+    """Число из переменной окружения; опечатка — предупреждение в лог и default, а не падение воркера."""
+    raw = os.environ.get(name)
+    if not raw:
+        return default
+    try:
+        return conv(raw)
+    except ValueError:
+        app.logger.warning("%s=%r is not a number, using the default", name, raw)
+        return default
 
 VAULT_PATH = Path(os.environ.get("PWGEN_VAULT_PATH", pwgen.DEFAULT_VAULT)).expanduser()
+_VAULT_PATH_STR = str(VAULT_PATH)
+
+def _prefetch_vault() -> None:
+    """Попросить ядро заранее поднять вольт в page cache (первый запрос после простоя)."""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(_VAULT_PATH_STR, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+_prefetch_vault()
+
+def _available_cpus() -> int:
+    """Ядра, доступные процессу: affinity/cpuset и квота cgroup v2, а не все ядра хоста."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(quota) // int(period)))
+    except (OSError, ValueError, ZeroDivisionError):
+        pass
+    return cpus
+
+def _new_vault_kdf_p() -> int:
+    override = _env_number("PWGEN_WEB_KDF_P", None)
+    if override is not None:
+        return max(1, override)
+    # Одновременно может идти WORKERS × THREADS выводов — делим ядра между ними
+    workers = _env_number("PWGEN_WEB_WORKERS", None) or _env_number("WEB_CONCURRENCY", 2)
+    threads = _env_number("PWGEN_WEB_THREADS", 2)
+    return max(pwgen.DEFAULT_KDF_P, min(_available_cpus() // max(1, workers * threads), 8))
+
+# Дорожки Argon2 для нового вольта: libargon2 считает их в отдельных потоках, поэтому
+# при той же работе и памяти расшифровка на многоядерном хосте быстрее. p навсегда
+# пишется в blob["kdf"] (открытие существующих вольтов это не задевает), поэтому
+# его можно задать явно через PWGEN_WEB_KDF_P.
+NEW_VAULT_KDF_P = _new_vault_kdf_p()
+
+# Кэши вокруг Argon2: расшифрованный вольт и выведенный ключ вольта.
+# Ключи кэшей содержат HMAC(SECRET_KEY, master) — сама фраза в памяти не хранится.
+VAULT_CACHE_TTL = 300   # секунд
+VAULT_CACHE_SIZE = 8
+
+
+class _TTLCache:
+    """Маленький потокобезопасный LRU с TTL."""
+
+    def __init__(self, size: int, ttl: float):
+        self.size, self.ttl = size, ttl
+        self._data = OrderedDict()   # key -> (stored_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            hit = self._data.get(key)
+            if hit is None:
+                return None
+            if now - hit[0] >= self.ttl:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return hit[1]
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+# Версия вольта — (st_mtime_ns, st_size, st_ino, nonce): stat сам по себе не отличит две
+# записи одного размера в один тик часов на переиспользованном inode, а nonce у каждой
+# записи свой (vault_seal берёт новый).
+# (версия, tag) -> (blob, pt)
+_VAULT_CACHE = _TTLCache(VAULT_CACHE_SIZE, VAULT_CACHE_TTL)
+# (salt, t, m, p, tag) -> ключ; соль меняется только при init, rewrite_plaintext её сохраняет
+_KEY_CACHE = _TTLCache(VAULT_CACHE_SIZE, VAULT_CACHE_TTL)
+# версия -> готовый HTML строк таблицы записей
+_ENTRIES_CACHE = _TTLCache(2, VAULT_CACHE_TTL)
+# path -> (checked_at, (os.stat_result, blob) | None); свои записи сбрасывают его сразу,
+# чужие (другой воркер) становятся видны не позже чем через VAULT_STAT_TTL
+VAULT_STAT_TTL = 0.25   # секунд
+_STAT_CACHE = {}
+
+# Переопределение длины: то же, что принимает int() для целого со знаком (пробелы
+# по краям снимаются, ведущие нули допустимы); диапазон 4..128 проверяется отдельно
+LENGTH_RE = re.compile(r"^[+-]?\d+$")
+# Потолки полей формы: мастер-фраза целиком уходит в Argon2, сайт может быть URL
+FIELD_LIMITS = (("master", 1024), ("site", 2048), ("login", 320), ("length", 16))
+
+# Задержка index() по action: Argon2 вольта ~0.1–1 с, поэтому корзины до 5 с.
+# Порог «медленного» запроса выше штатной цены, иначе предупреждение шло бы на каждый
+# POST: холодный кэш — Argon2 вольта (t=3, m = 128 MiB, ~0.3–0.5 с), плюс на generate
+# Argon2 записи — new_entry_kdf() (t=1, m = 32 MiB, ~50 мс), а у старых записей без
+# "kdf" тоже DEFAULT_KDF_* (~0.3–0.5 с). Худший штатный случай ~1 с, порог — с запасом.
+SLOW_REQUEST_MS = _env_number("PWGEN_WEB_SLOW_MS", 2500.0, float)
+METRICS_ENABLED = _HAS_PROMETHEUS and os.environ.get("PWGEN_WEB_METRICS") == "1"
+if METRICS_ENABLED:
+    _LATENCY = Histogram(
+        "pwgen_web_index_seconds", "index() latency by action", ["action"],
+        buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0),
+    )
+
+_METRIC_ACTIONS = frozenset({"GET", "init_vault", "add_entry", "rotate_c", "rotate_rseed", "generate", "list"})
+
+def _observe_latency(action: str, started: float) -> None:
+    elapsed = time.perf_counter() - started
+    if action not in _METRIC_ACTIONS:
+        action = "other"   # action приходит из формы — не плодим метки
+    if METRICS_ENABLED:
+        _LATENCY.labels(action=action).observe(elapsed)
+    if elapsed * 1000 > SLOW_REQUEST_MS:
+        app.logger.warning("slow index(): action=%s %.0f ms", action, elapsed * 1000)
+
+# -------------------------------- Static assets ---------------------------------
+
+# CSS и JS отдаются отдельными файлами (/pwgen.css, /pwgen.js) с immutable Cache-Control,
+# а не в каждой странице. Версия в URL меняется вместе с содержимым.
+STYLE_CSS = """:root{
+  --bg:#0b0f1a; --surface:#0f1722; --glass: rgba(255,255,255,.06);
+  --stroke:#253043; --text:#e6eaf0; --muted:#b0bbcc; --muted-weak:#8a97ad;
+  --ok:#10b981; --warn:#f59e0b; --err:#ef4444; --info:#38bdf8;
+  --g1:#22d3ee; --g2:#6366f1; --btn-text:#0b1220;
+  --radius:14px; --shadow:0 10px 28px rgba(0,0,0,.35);
+  --ring:#38bdf8; --ring-outer:#38bdf82a;
+}
+html[data-theme="light"]{
+  --bg:#f5f7fb; --surface:#ffffff; --glass: rgba(0,0,0,.03);
+  --stroke:#d9e2ee; --text:#0e1524; --muted:#475569; --muted-weak:#64748b;
+  --btn-text:#0b1220; --ring:#2563eb; --ring-outer:#2563eb22;
+}
+
+*{box-sizing:border-box}
+html,body{height:100%}
+body{
+  margin:0; padding:32px; display:grid; place-items:start center;
+  background:var(--bg); color:var(--text);
+  font:16px/1.5 system-ui,-apple-system,"Segoe UI",Roboto,Inter,sans-serif;
+  -webkit-font-smoothing:antialiased; -moz-osx-font-smoothing:grayscale;
+  transition: background-color .35s ease, color .35s ease;
+}
+
+.backdrop,.backdrop::after{
+  content:""; position:fixed; inset:-20% -10% auto -10%; height:80%;
+  background:
+    radial-gradient(60% 60% at 18% 22%, #4758ff33 0%, transparent 60%),
+    radial-gradient(48% 48% at 82% 28%, #00d3ff33 0%, transparent 62%),
+    radial-gradient(38% 38% at 28% 84%, #10b9812e 0%, transparent 65%);
+  filter: blur(70px) saturate(120%); pointer-events:none; z-index:0; opacity:.7;
+  animation: backdropFloat 26s cubic-bezier(.2,.6,.1,1) infinite alternate;
+}
+.backdrop::after{ inset:auto -10% -22% -10%; height:72%; transform:scaleX(-1); opacity:.55 }
+@keyframes backdropFloat { from{transform:translateY(-2%) rotate(0)} to{transform:translateY(2%) rotate(2deg)} }
+@media (prefers-reduced-motion:reduce){ .backdrop,.backdrop::after{ animation:none } }
+
+.wrap{ width:min(980px,100%); position:relative; z-index:1 }
+.card{
+  background: linear-gradient(180deg, rgba(255,255,255,.04), rgba(255,255,255,.02)) , var(--surface);
+  border:1px solid var(--stroke); border-radius:var(--radius);
+  box-shadow: var(--shadow), inset 0 1px 0 rgba(255,255,255,.05);
+  padding:22px 22px 18px;
+  transition: transform .3s cubic-bezier(.2,.6,.1,1), box-shadow .3s, background-color .35s ease;
+}
+html[data-theme="light"] .card{ background:var(--surface) }
+.card:hover{ transform:translateY(-1px); box-shadow:0 16px 36px rgba(0,0,0,.18) }
+
+.toolbar{ display:flex; gap:8px; justify-content:flex-end; margin-bottom:6px }
+.iconbtn{
+  min-width:40px; height:40px; border-radius:12px; border:1px solid var(--stroke);
+  background:#141c28; color:var(--text); cursor:pointer; transition: filter .2s, transform .08s;
+}
+html[data-theme="light"] .iconbtn{ background:#f1f5f9 }
+.iconbtn:hover{ filter:brightness(1.07) }
+.iconbtn:active{ transform:translateY(1px) }
+.iconbtn:focus-visible{ outline:2px solid var(--ring); outline-offset:2px }
+
+h1{margin:4px 0 8px; font-size:28px; letter-spacing:.2px}
+.subtle{color:var(--muted); font-size:13px}
+
+form{display:grid; gap:14px; grid-template-columns:1fr 1fr; margin-top:16px}
+label{display:flex; flex-direction:column; gap:8px; font-weight:600; font-size:14px}
+input, select{
+  font:inherit; padding:12px 14px; border-radius:12px; outline:none;
+  border:1px solid var(--stroke); background:#151e2b; color:var(--text);
+  transition: box-shadow .28s, border-color .28s, transform .06s, background-color .35s ease;
+}
+html[data-theme="light"] input, html[data-theme="light"] select{ background:#ffffff }
+input::placeholder{color:#9db0c6}
+html[data-theme="light"] input::placeholder{color:#64748b}
+input:focus-visible, select:focus-visible{ border-color:var(--ring); box-shadow:0 0 0 2px var(--ring), 0 0 0 8px var(--ring-outer) }
+input:active{ transform:scale(.996) }
+
+.actions{grid-column:1 / -1; display:flex; flex-wrap:wrap; gap:10px}
+.btn{
+  position:relative; border:none; padding:12px 16px; border-radius:12px; cursor:pointer;
+  color:var(--btn-text); background:#e6eef7; font-weight:700; letter-spacing:.2px;
+  transition: transform .08s ease, filter .2s ease, box-shadow .25s ease, background-color .35s ease;
+  box-shadow: 0 8px 16px rgba(0,0,0,.22); user-select:none;
+}
+html[data-theme="light"] .btn{ background:#e6eef7 }
+.btn:hover{ filter:brightness(1.06) }
+.btn:active{ transform: translateY(1px) scale(.995) }
+.btn:focus-visible{ outline:2px solid var(--ring); outline-offset:2px }
+.btn.primary{
+  background:linear-gradient(135deg, var(--g1), var(--g2)); color:white; text-shadow:0 1px 0 rgba(0,0,0,.35);
+  box-shadow: 0 12px 24px rgba(99,102,241,.32);
+}
+.btn.ghost{ background:#141c28; color:var(--text); border:1px solid var(--stroke) }
+html[data-theme="light"] .btn.ghost{ background:#f8fafc }
+
+.btn .ink{ position:absolute; border-radius:999px; transform:scale(0); opacity:.35; background:#fff;
+           animation:ripple .7s cubic-bezier(.2,.7,.1,1); pointer-events:none }
+@keyframes ripple{ to{ transform:scale(18); opacity:0 } }
+@media (prefers-reduced-motion:reduce){ .btn .ink{ display:none } }
+
+.result{ margin:14px 0 18px }
+.pwd-row{ display:flex; gap:10px; align-items:center }
+.pwd{
+  flex:1; font-family: ui-monospace, SFMono-Regular, Menlo, Consolas, "Liberation Mono", monospace;
+  font-size:15px; padding:12px 14px; border-radius:12px;
+  border:1px solid var(--stroke); background:#121a25; color:var(--text);
+  transition: background-color .35s ease;
+}
+html[data-theme="light"] .pwd{ background:#ffffff }
+.meta{ margin-top:6px; color:var(--muted-weak); font-size:12px }
+
+.toasts{ position:fixed; top:16px; right:16px; display:grid; gap:10px; z-index:10 }
+.toast{
+  padding:10px 12px; border-radius:12px; border:1px solid var(--stroke);
+  background:#101826; color:var(--text);
+  box-shadow:var(--shadow); backdrop-filter: blur(10px);
+  animation: slidein .35s cubic-bezier(.2,.7,.1,1);
+}
+html[data-theme="light"] .toast{ background:#ffffff }
+.toast.success{ border-color:#0e5; box-shadow:0 10px 28px rgba(16,185,129,.18) }
+.toast.error  { border-color:#f55; box-shadow:0 10px 28px rgba(239,68,68,.18) }
+.toast.warning{ border-color:#fb0; box-shadow:0 10px 28px rgba(245,158,11,.18) }
+.toast.info   { border-color:#4cf; box-shadow:0 10px 28px rgba(56,189,248,.18) }
+@keyframes slidein{ from{transform:translateY(-8px); opacity:0} to{transform:none; opacity:1} }
+@media (prefers-reduced-motion:reduce){ .toast{ animation:none } }
+
+.hint{ color:var(--muted); font-size:12px; margin-top:6px }
+table{ width:100%; border-collapse:separate; border-spacing:0 10px; margin-top:10px }
+th{ text-align:left; font-size:12px; color:#c5d0e0; padding:0 10px }
+html[data-theme="light"] th{ color:#4b5563 }
+td{ background:#0f1724; border:1px solid var(--stroke); padding:10px 12px; color:var(--text) }
+html[data-theme="light"] td{ background:#f8fafc }
+td:first-child{ border-radius:12px 0 0 12px }
+td:last-child { border-radius:0 12px 12px 0 }
+
+.badge{ display:inline-flex; align-items:center; gap:6px; padding:4px 8px; border-radius:999px;
+        font-size:12px; background:#121a27; border:1px solid var(--stroke); color:#d9e3ef }
+html[data-theme="light"] .badge{ background:#eef2f7; color:#0e1524 }
+
+.pill{ padding:.2rem .5rem; border-radius:999px; border:1px solid var(--stroke); background:#121a27; color:#d9e3ef }
+html[data-theme="light"] .pill{ background:#eef2f7; color:#0e1524 }
+
+:focus{ outline:none }
+:focus-visible{ outline:2px solid var(--ring); outline-offset:2px }
+"""
+SCRIPT_JS = """const reducedMotion=matchMedia('(prefers-reduced-motion: reduce)');
+const idle=window.requestIdleCallback || (f=>setTimeout(f,1));
+// Рябь — косметика: один делегированный обработчик, навешивается после первой отрисовки
+idle(()=>document.addEventListener('click', e => {
+  const b=e.target.closest && e.target.closest('.btn');
+  if (!b || reducedMotion.matches) return;
+  const r=document.createElement('span'); r.className='ink';
+  const rect=b.getBoundingClientRect(); const x=e.clientX-rect.left, y=e.clientY-rect.top;
+  r.style.left=(x-10)+'px'; r.style.top=(y-10)+'px';
+  r.style.width=r.style.height=Math.max(rect.width,rect.height)+'px';
+  b.appendChild(r); setTimeout(()=>r.remove(),700);
+}, {passive:true}));
+
+const toasts=document.getElementById('toasts');
+if (toasts){ for (const t of [...toasts.children]) {
+  setTimeout(()=>{ t.style.transition='opacity .45s, transform .45s';
+    t.style.opacity='0'; t.style.transform='translateY(-6px)';
+    setTimeout(()=>t.remove(),460); }, 4400); } }
+
+const THEME_KEY='pwgen_theme';
+const themeBtn=document.getElementById('themeBtn');
+const metaTheme=document.getElementById('theme-color');
+function applyTheme(t){
+  document.documentElement.setAttribute('data-theme', t);
+  metaTheme && metaTheme.setAttribute('content', t==='light' ? '""" + APP_THEME_LIGHT + """' : '""" + APP_THEME_DARK + """');
+  localStorage.setItem(THEME_KEY, t);
+  themeBtn.textContent = t==='light' ? '🌞' : '🌙';
+}
+const saved = localStorage.getItem(THEME_KEY);
+const sysLight = matchMedia('(prefers-color-scheme: light)').matches ? 'light':'dark';
+applyTheme(saved || sysLight);
+themeBtn.onclick = () => applyTheme(document.documentElement.getAttribute('data-theme')==='light' ? 'dark' : 'light');
+
+if ('serviceWorker' in navigator){ navigator.serviceWorker.register('/sw.js'); }
+let deferredPrompt=null;
+const installBtn=document.getElementById('installBtn');
+window.addEventListener('beforeinstallprompt', (e)=>{ e.preventDefault(); deferredPrompt=e; installBtn.hidden=false; });
+installBtn?.addEventListener('click', async ()=>{
+  if(!deferredPrompt) return;
+  deferredPrompt.prompt();
+  await deferredPrompt.userChoice; deferredPrompt=null; installBtn.hidden=true;
+});
+"""
+
+def _asset_url(path: str, body: str) -> str:
+    return path + "?v=" + hashlib.sha256(body.encode("utf-8")).hexdigest()[:12]
+
+STYLE_URL = _asset_url("/pwgen.css", STYLE_CSS)
+SCRIPT_URL = _asset_url("/pwgen.js", SCRIPT_JS)
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# gzip — один раз при импорте и только для ассетов: HTML страницы содержит пароль рядом
+# с эхом полей формы, и его сжатие открыло бы BREACH
+_STYLE_CSS_GZ = gzip.compress(STYLE_CSS.encode("utf-8"), 9, mtime=0)
+_SCRIPT_JS_GZ = gzip.compress(SCRIPT_JS.encode("utf-8"), 9, mtime=0)
 
 # -------------------------------- HTML Template ---------------------------------
 
@@ -50,149 +433,7 @@ HTML_TEMPLATE = """<!doctype html>
   <link rel="icon" href="/icon.svg" type="image/svg+xml">
   <meta id="theme-color" name="theme-color" content="#0b0f1a">
 
-  <style>
-    :root{
-      --bg:#0b0f1a; --surface:#0f1722; --glass: rgba(255,255,255,.06);
-      --stroke:#253043; --text:#e6eaf0; --muted:#b0bbcc; --muted-weak:#8a97ad;
-      --ok:#10b981; --warn:#f59e0b; --err:#ef4444; --info:#38bdf8;
-      --g1:#22d3ee; --g2:#6366f1; --btn-text:#0b1220;
-      --radius:14px; --shadow:0 10px 28px rgba(0,0,0,.35);
-      --ring:#38bdf8; --ring-outer:#38bdf82a;
-    }
-    html[data-theme="light"]{
-      --bg:#f5f7fb; --surface:#ffffff; --glass: rgba(0,0,0,.03);
-      --stroke:#d9e2ee; --text:#0e1524; --muted:#475569; --muted-weak:#64748b;
-      --btn-text:#0b1220; --ring:#2563eb; --ring-outer:#2563eb22;
-    }
-
-    *{box-sizing:border-box}
-    html,body{height:100%}
-    body{
-      margin:0; padding:32px; display:grid; place-items:start center;
-      background:var(--bg); color:var(--text);
-      font:16px/1.5 system-ui,-apple-system,"Segoe UI",Roboto,Inter,sans-serif;
-      -webkit-font-smoothing:antialiased; -moz-osx-font-smoothing:grayscale;
-      transition: background-color .35s ease, color .35s ease;
-    }
-
-    .backdrop,.backdrop::after{
-      content:""; position:fixed; inset:-20% -10% auto -10%; height:80%;
-      background:
-        radial-gradient(60% 60% at 18% 22%, #4758ff33 0%, transparent 60%),
-        radial-gradient(48% 48% at 82% 28%, #00d3ff33 0%, transparent 62%),
-        radial-gradient(38% 38% at 28% 84%, #10b9812e 0%, transparent 65%);
-      filter: blur(70px) saturate(120%); pointer-events:none; z-index:0; opacity:.7;
-      animation: backdropFloat 26s cubic-bezier(.2,.6,.1,1) infinite alternate;
-    }
-    .backdrop::after{ inset:auto -10% -22% -10%; height:72%; transform:scaleX(-1); opacity:.55 }
-    @keyframes backdropFloat { from{transform:translateY(-2%) rotate(0)} to{transform:translateY(2%) rotate(2deg)} }
-    @media (prefers-reduced-motion:reduce){ .backdrop,.backdrop::after{ animation:none } }
-
-    .wrap{ width:min(980px,100%); position:relative; z-index:1 }
-    .card{
-      background: linear-gradient(180deg, rgba(255,255,255,.04), rgba(255,255,255,.02)) , var(--surface);
-      border:1px solid var(--stroke); border-radius:var(--radius);
-      box-shadow: var(--shadow), inset 0 1px 0 rgba(255,255,255,.05);
-      padding:22px 22px 18px;
-      transition: transform .3s cubic-bezier(.2,.6,.1,1), box-shadow .3s, background-color .35s ease;
-    }
-    html[data-theme="light"] .card{ background:var(--surface) }
-    .card:hover{ transform:translateY(-1px); box-shadow:0 16px 36px rgba(0,0,0,.18) }
-
-    .toolbar{ display:flex; gap:8px; justify-content:flex-end; margin-bottom:6px }
-    .iconbtn{
-      min-width:40px; height:40px; border-radius:12px; border:1px solid var(--stroke);
-      background:#141c28; color:var(--text); cursor:pointer; transition: filter .2s, transform .08s;
-    }
-    html[data-theme="light"] .iconbtn{ background:#f1f5f9 }
-    .iconbtn:hover{ filter:brightness(1.07) }
-    .iconbtn:active{ transform:translateY(1px) }
-    .iconbtn:focus-visible{ outline:2px solid var(--ring); outline-offset:2px }
-
-    h1{margin:4px 0 8px; font-size:28px; letter-spacing:.2px}
-    .subtle{color:var(--muted); font-size:13px}
-
-    form{display:grid; gap:14px; grid-template-columns:1fr 1fr; margin-top:16px}
-    label{display:flex; flex-direction:column; gap:8px; font-weight:600; font-size:14px}
-    input, select{
-      font:inherit; padding:12px 14px; border-radius:12px; outline:none;
-      border:1px solid var(--stroke); background:#151e2b; color:var(--text);
-      transition: box-shadow .28s, border-color .28s, transform .06s, background-color .35s ease;
-    }
-    html[data-theme="light"] input, html[data-theme="light"] select{ background:#ffffff }
-    input::placeholder{color:#9db0c6}
-    html[data-theme="light"] input::placeholder{color:#64748b}
-    input:focus-visible, select:focus-visible{ border-color:var(--ring); box-shadow:0 0 0 2px var(--ring), 0 0 0 8px var(--ring-outer) }
-    input:active{ transform:scale(.996) }
-
-    .actions{grid-column:1 / -1; display:flex; flex-wrap:wrap; gap:10px}
-    .btn{
-      position:relative; border:none; padding:12px 16px; border-radius:12px; cursor:pointer;
-      color:var(--btn-text); background:#e6eef7; font-weight:700; letter-spacing:.2px;
-      transition: transform .08s ease, filter .2s ease, box-shadow .25s ease, background-color .35s ease;
-      box-shadow: 0 8px 16px rgba(0,0,0,.22); user-select:none;
-    }
-    html[data-theme="light"] .btn{ background:#e6eef7 }
-    .btn:hover{ filter:brightness(1.06) }
-    .btn:active{ transform: translateY(1px) scale(.995) }
-    .btn:focus-visible{ outline:2px solid var(--ring); outline-offset:2px }
-    .btn.primary{
-      background:linear-gradient(135deg, var(--g1), var(--g2)); color:white; text-shadow:0 1px 0 rgba(0,0,0,.35);
-      box-shadow: 0 12px 24px rgba(99,102,241,.32);
-    }
-    .btn.ghost{ background:#141c28; color:var(--text); border:1px solid var(--stroke) }
-    html[data-theme="light"] .btn.ghost{ background:#f8fafc }
-
-    .btn .ink{ position:absolute; border-radius:999px; transform:scale(0); opacity:.35; background:#fff;
-               animation:ripple .7s cubic-bezier(.2,.7,.1,1); pointer-events:none }
-    @keyframes ripple{ to{ transform:scale(18); opacity:0 } }
-    @media (prefers-reduced-motion:reduce){ .btn .ink{ display:none } }
-
-    .result{ margin:14px 0 18px }
-    .pwd-row{ display:flex; gap:10px; align-items:center }
-    .pwd{
-      flex:1; font-family: ui-monospace, SFMono-Regular, Menlo, Consolas, "Liberation Mono", monospace;
-      font-size:15px; padding:12px 14px; border-radius:12px;
-      border:1px solid var(--stroke); background:#121a25; color:var(--text);
-      transition: background-color .35s ease;
-    }
-    html[data-theme="light"] .pwd{ background:#ffffff }
-    .meta{ margin-top:6px; color:var(--muted-weak); font-size:12px }
-
-    .toasts{ position:fixed; top:16px; right:16px; display:grid; gap:10px; z-index:10 }
-    .toast{
-      padding:10px 12px; border-radius:12px; border:1px solid var(--stroke);
-      background:#101826; color:var(--text);
-      box-shadow:var(--shadow); backdrop-filter: blur(10px);
-      animation: slidein .35s cubic-bezier(.2,.7,.1,1);
-    }
-    html[data-theme="light"] .toast{ background:#ffffff }
-    .toast.success{ border-color:#0e5; box-shadow:0 10px 28px rgba(16,185,129,.18) }
-    .toast.error  { border-color:#f55; box-shadow:0 10px 28px rgba(239,68,68,.18) }
-    .toast.warning{ border-color:#fb0; box-shadow:0 10px 28px rgba(245,158,11,.18) }
-    .toast.info   { border-color:#4cf; box-shadow:0 10px 28px rgba(56,189,248,.18) }
-    @keyframes slidein{ from{transform:translateY(-8px); opacity:0} to{transform:none; opacity:1} }
-    @media (prefers-reduced-motion:reduce){ .toast{ animation:none } }
-
-    .hint{ color:var(--muted); font-size:12px; margin-top:6px }
-    table{ width:100%; border-collapse:separate; border-spacing:0 10px; margin-top:10px }
-    th{ text-align:left; font-size:12px; color:#c5d0e0; padding:0 10px }
-    html[data-theme="light"] th{ color:#4b5563 }
-    td{ background:#0f1724; border:1px solid var(--stroke); padding:10px 12px; color:var(--text) }
-    html[data-theme="light"] td{ background:#f8fafc }
-    td:first-child{ border-radius:12px 0 0 12px }
-    td:last-child { border-radius:0 12px 12px 0 }
-
-    .badge{ display:inline-flex; align-items:center; gap:6px; padding:4px 8px; border-radius:999px;
-            font-size:12px; background:#121a27; border:1px solid var(--stroke); color:#d9e3ef }
-    html[data-theme="light"] .badge{ background:#eef2f7; color:#0e1524 }
-
-    .pill{ padding:.2rem .5rem; border-radius:999px; border:1px solid var(--stroke); background:#121a27; color:#d9e3ef }
-    html[data-theme="light"] .pill{ background:#eef2f7; color:#0e1524 }
-
-    :focus{ outline:none }
-    :focus-visible{ outline:2px solid var(--ring); outline-offset:2px }
-  </style>
+  <link rel="stylesheet" href="{{ css_url }}">
 </head>
 <body>
   <div class="backdrop" aria-hidden="true"></div>
@@ -245,9 +486,7 @@ HTML_TEMPLATE = """<!doctype html>
         <label>
           Профиль (для создания записи)
           <select name="profile" aria-label="Профиль">
-            {% for p in profiles %}
-              <option value="{{ p }}" {% if profile==p %}selected{% endif %}>{{ p }}</option>
-            {% endfor %}
+            {{ profile_options }}
           </select>
         </label>
 
@@ -266,301 +505,450 @@ HTML_TEMPLATE = """<!doctype html>
         </div>
       </form>
 
-      {% if entries %}
+      {% if entries_html %}
         <div class="hint">Сайты в хранилище</div>
         <table role="table" aria-label="Сайты в хранилище">
           <thead>
             <tr><th>Сайт</th><th>Логин</th><th>Длина</th><th>Классы</th><th>c</th><th>Версия</th></tr>
           </thead>
           <tbody>
-          {% for item in entries %}
-            <tr>
-              <td>{{ item.site_id }}</td>
-              <td>{{ item.login }}</td>
-              <td>{{ item.policy.length }}</td>
-              <td>{{ ','.join(item.policy.classes) }}</td>
-              <td><span class="badge">c={{ item.c }}</span></td>
-              <td>{{ item.v }}</td>
-            </tr>
-          {% endfor %}
+{{ entries_html }}
           </tbody>
         </table>
       {% endif %}
     </div>
   </div>
 
-  <script>
-    for (const b of document.querySelectorAll('.btn')) {
-      b.addEventListener('click', e => {
-        if (matchMedia('(prefers-reduced-motion: reduce)').matches) return;
-        const r=document.createElement('span'); r.className='ink';
-        const rect=b.getBoundingClientRect(); const x=e.clientX-rect.left, y=e.clientY-rect.top;
-        r.style.left=(x-10)+'px'; r.style.top=(y-10)+'px';
-        r.style.width=r.style.height=Math.max(rect.width,rect.height)+'px';
-        b.appendChild(r); setTimeout(()=>r.remove(),700);
-      }, {passive:true});
-    }
-
-    const toasts=document.getElementById('toasts');
-    if (toasts){ for (const t of [...toasts.children]) {
-      setTimeout(()=>{ t.style.transition='opacity .45s, transform .45s';
-        t.style.opacity='0'; t.style.transform='translateY(-6px)';
-        setTimeout(()=>t.remove(),460); }, 4400); } }
-
-    const THEME_KEY='pwgen_theme';
-    const themeBtn=document.getElementById('themeBtn');
-    const metaTheme=document.getElementById('theme-color');
-    function applyTheme(t){
-      document.documentElement.setAttribute('data-theme', t);
-      metaTheme && metaTheme.setAttribute('content', t==='light' ? '{{ theme_light }}' : '{{ theme_dark }}');
-      localStorage.setItem(THEME_KEY, t);
-      themeBtn.textContent = t==='light' ? '🌞' : '🌙';
-    }
-    const saved = localStorage.getItem(THEME_KEY);
-    const sysLight = matchMedia('(prefers-color-scheme: light)').matches ? 'light':'dark';
-    applyTheme(saved || sysLight);
-    themeBtn.onclick = () => applyTheme(document.documentElement.getAttribute('data-theme')==='light' ? 'dark' : 'light');
-
-    if ('serviceWorker' in navigator){ navigator.serviceWorker.register('/sw.js'); }
-    let deferredPrompt=null;
-    const installBtn=document.getElementById('installBtn');
-    window.addEventListener('beforeinstallprompt', (e)=>{ e.preventDefault(); deferredPrompt=e; installBtn.hidden=false; });
-    installBtn?.addEventListener('click', async ()=>{
-      if(!deferredPrompt) return;
-      deferredPrompt.prompt();
-      await deferredPrompt.userChoice; deferredPrompt=null; installBtn.hidden=true;
-    });
-  </script>
+  <script src="{{ js_url }}"></script>
 </body>
 </html>
 """
 
+# Шаблон компилируется один раз при импорте, а не на каждый запрос (render_template_string)
+INDEX_TEMPLATE = app.jinja_env.from_string(HTML_TEMPLATE)
+
 # ------------------------------- Helper functions -------------------------------
 
+def _vault_state(fresh: bool = False):
+    """(stat, blob) вольта с коротким TTL (None, если файла нет) — на сетевых томах это дорого.
+    stat снят fstat'ом с того же открытого файла, из которого прочитан blob, поэтому пара
+    согласована даже при одновременном os.replace. blob — None, если файл не JSON.
+    fresh=True — мимо TTL: перед изменением вольта нужна версия, которую мог записать другой воркер."""
+    now = time.monotonic()
+    hit = _STAT_CACHE.get(_VAULT_PATH_STR)
+    if not fresh and hit is not None and now - hit[0] < VAULT_STAT_TTL:
+        return hit[1]
+    try:
+        with open(_VAULT_PATH_STR, "rb") as f:
+            st = os.fstat(f.fileno())
+            raw = f.read()
+        try:
+            blob = pwgen.json_loads(raw)
+        except ValueError:
+            blob = None
+        state = (st, blob)
+    except FileNotFoundError:
+        state = None
+    _STAT_CACHE[_VAULT_PATH_STR] = (now, state)
+    return state
+
+def vault_stat(fresh: bool = False):
+    """stat вольта из _vault_state (None, если файла нет)."""
+    state = _vault_state(fresh)
+    return None if state is None else state[0]
+
+def _version_of(st: os.stat_result, blob: Optional[dict]) -> tuple:
+    try:
+        nonce = blob["aead"]["nonce"]
+    except (TypeError, KeyError):
+        nonce = None
+    return (st.st_mtime_ns, st.st_size, st.st_ino, nonce)
+
+def vault_version() -> tuple:
+    """Отпечаток файла вольта: меняется при каждой перезаписи (новый nonce)."""
+    state = _vault_state()
+    if state is None:
+        raise FileNotFoundError(_VAULT_PATH_STR)
+    return _version_of(*state)
+
+# tldextract/IDNA на каждый запрос не нужны: доменов у пользователя немного
+_normalize_site_id = lru_cache(maxsize=512)(pwgen.normalize_site_id)
+
+def _master_tag(master: str) -> bytes:
+    return hmac.digest(app.config["SECRET_KEY"].encode("utf-8"), master.encode("utf-8"), "sha256")
+
+def _key_cache_key(blob: dict, tag: bytes) -> tuple:
+    kdf = blob["kdf"]
+    return (kdf["salt"], int(kdf["t"]), int(kdf["m"]), int(kdf["p"]), tag)
+
+def invalidate_vault_cache() -> None:
+    # _KEY_CACHE не трогаем намеренно: ключ зависит только от (salt, t, m, p, фраза),
+    # rewrite_plaintext сохраняет blob["kdf"], а новый вольт получает новую соль и
+    # другой ключ кэша. Сброс ключа заставил бы каждую запись снова гонять Argon2.
+    _VAULT_CACHE.clear()
+    _STAT_CACHE.clear()
+
+def vault_key(blob: dict, master: str, tag: bytes) -> bytes:
+    """Ключ вольта из кэша или через Argon2id."""
+    ck = _key_cache_key(blob, tag)
+    key = _KEY_CACHE.get(ck)
+    if key is None:
+        key = pwgen.vault_key(blob, master)
+    return key
+
 def load_vault(master: str) -> dict:
-    blob = pwgen.vault_load(str(VAULT_PATH))
-    plaintext = pwgen.vault_decrypt(blob, master)
-    return json.loads(plaintext.decode("utf-8"))
+    return load_blob_and_plaintext(master)[1]
 
 def load_blob_and_plaintext(master: str):
-    """Вернёт (blob, pt) c исходными kdf-параметрами."""
-    blob = pwgen.vault_load(str(VAULT_PATH))
-    plaintext = pwgen.vault_decrypt(blob, master)
-    return blob, json.loads(plaintext.decode("utf-8"))
-
-def format_entries(raw_sites: dict) -> list:
-    entries = []
-    for entry in raw_sites.values():
-        entries.append({
-            "site_id": entry["site_id"],
-            "login": entry["login"],
-            "policy": entry["policy"],
-            "c": entry.get("c", 0),
-            "v": entry.get("v", pwgen.ALGO_VERSION),
-        })
-    entries.sort(key=lambda x: (x["site_id"], x["login"]))
+    """Вернёт (blob, pt) c исходными kdf-параметрами. Копии — вызывающий может их менять."""
+    tag = _master_tag(master)
+    state = _vault_state()
+    if state is None:
+        raise FileNotFoundError(_VAULT_PATH_STR)
+    if state[1] is None:
+        raise ValueError("файл вольта не является JSON")
+    ck = _version_of(*state) + (tag,)
+    hit = _VAULT_CACHE.get(ck)
+    if hit is not None:
+        return copy.deepcopy(hit[0]), copy.deepcopy(hit[1])
+    # тот же blob, по которому посчитана версия, — без повторного чтения файла
+    blob = copy.deepcopy(state[1])
+    key = vault_key(blob, master, tag)
+    pt = pwgen.json_loads(pwgen.vault_open(blob, key))
+    # ключ кладём только после успешного открытия — неверная фраза в кэш не попадает
+    _KEY_CACHE.put(_key_cache_key(blob, tag), key)
+    _VAULT_CACHE.put(ck, (copy.deepcopy(blob), copy.deepcopy(pt)))
+    return blob, pt
+
+def create_vault(master: str):
+    """Создать вольт; вернёт (blob, pt) без повторной расшифровки только что записанного файла."""
+    capsule = pwgen.make_capsule("")
+    pt = pwgen.make_empty_plaintext(pwgen.b64e(capsule))
+    key, kdf = pwgen.vault_new_key(master, pwgen.DEFAULT_KDF_T, pwgen.DEFAULT_KDF_M, NEW_VAULT_KDF_P)
+    blob = pwgen.vault_seal(pwgen.json_dumps_bytes(pt), key, kdf)
+    try:
+        st = pwgen.vault_save(_VAULT_PATH_STR, blob)
+    finally:
+        invalidate_vault_cache()
+    tag = _master_tag(master)
+    _KEY_CACHE.put(_key_cache_key(blob, tag), key)
+    _remember_written(st, tag, blob, pt)
+    return blob, pt
+
+def save_plaintext(master: str, data: dict, blob: dict) -> None:
+    """Перешифровать вольт тем же ключом/солью (blob["kdf"]), новый nonce.
+    Кэш вольта сбрасывается и сразу получает записанную версию — следующий запрос её не расшифровывает."""
+    tag = _master_tag(master)
+    try:
+        key = vault_key(blob, master, tag)
+        new_blob, st = pwgen.rewrite_plaintext(_VAULT_PATH_STR, key, blob["kdf"], data)
+    finally:
+        invalidate_vault_cache()
+    _remember_written(st, tag, new_blob, data)
+
+def _remember_written(st: os.stat_result, tag: bytes, blob: dict, pt: dict) -> None:
+    # stat снят с временного файла до os.replace: если вольт успел перезаписать другой
+    # воркер, версия не совпадёт с файлом на диске и запись просто не будет найдена
+    _VAULT_CACHE.put(_version_of(st, blob) + (tag,), (copy.deepcopy(blob), copy.deepcopy(pt)))
+
+class Entry(NamedTuple):
+    """Строка таблицы записей (только то, что показывает шаблон)."""
+    site_id: str
+    login: str
+    length: int
+    classes: tuple
+    c: int
+    v: str
+
+def format_entries(raw_sites: dict) -> Sequence[Entry]:
+    if not raw_sites:
+        return ()
+    legacy = pwgen.LEGACY_ALGO_VERSION
+    entries = [
+        Entry(
+            entry["site_id"],
+            entry["login"],
+            entry["policy"]["length"],
+            tuple(entry["policy"]["classes"]),
+            entry.get("c", 0),
+            entry.get("v", legacy),
+        )
+        for entry in raw_sites.values()
+    ]
+    entries.sort(key=attrgetter("site_id", "login"))
     return entries
 
+def render_entries_html(entries: Sequence[Entry]) -> Markup:
+    """Строки <tbody> одним join — без цикла шаблона по каждой ячейке."""
+    return Markup("".join(
+        f'<tr><td>{escape(e.site_id)}</td><td>{escape(e.login)}</td><td>{escape(e.length)}</td>'
+        f'<td>{escape(",".join(e.classes))}</td><td><span class="badge">c={escape(e.c)}</span></td>'
+        f'<td>{escape(e.v)}</td></tr>'
+        for e in entries
+    ))
+
+def cached_entries_html(data: dict) -> Markup:
+    """Таблица записей для текущей версии файла; data должен совпадать с вольтом на диске."""
+    version = vault_version()
+    html = _ENTRIES_CACHE.get(version)
+    if html is None:
+        html = render_entries_html(format_entries(data["sites"]))
+        _ENTRIES_CACHE.put(version, html)
+    return html
+
+def _profile_options(selected: str) -> Markup:
+    return Markup("".join(
+        f'<option value="{escape(p)}"{" selected" if p == selected else ""}>{escape(p)}</option>'
+        for p in pwgen.PROFILES
+    ))
+
+# Список профилей постоянен — готовый <select> под каждый выбранный профиль
+_PROFILE_OPTIONS = {p: _profile_options(p) for p in pwgen.PROFILES}
+
+# ------------------------------------ Actions ----------------------------------
+
+class _ActionContext:
+    """Один POST: поля формы, расшифрованный вольт и то, что покажет шаблон."""
+
+    def __init__(self, master: str, site: str, login: str, length: str, profile: str):
+        self.master = master
+        self.site, self.login, self.length, self.profile = site, login, length, profile
+        self.blob = None
+        self.data = None
+        self.vault_exists = False
+        self.password = None
+        self.used_c = None
+        self.version = None
+
+def _require_site_login(ctx: _ActionContext, message: str):
+    """(site_id, login, ключ записи) или None с сообщением об ошибке."""
+    if not ctx.site or not ctx.login:
+        flash(message, "error")
+        return None
+    site_id = _normalize_site_id(ctx.site)
+    login = ctx.login.strip()
+    return site_id, login, f"{site_id}|{login}"
+
+def _require_entry(ctx: _ActionContext, message: str):
+    """(site_id, login, ключ, запись) для существующей пары сайт/логин или None."""
+    found = _require_site_login(ctx, message)
+    if found is None:
+        return None
+    entry = ctx.data["sites"].get(found[2])
+    if not entry:
+        flash("Такой пары сайт/логин нет в хранилище.", "error")
+        return None
+    return found + (entry,)
+
+# Обработчик возвращает сообщение об успехе, если изменил вольт и его нужно сохранить.
+
+def _do_init_vault(ctx: _ActionContext) -> Optional[str]:
+    if ctx.vault_exists:
+        flash("Вольт уже существует.", "info")
+        return None
+    try:
+        ctx.blob, ctx.data = create_vault(ctx.master)
+        flash("Вольт создан.", "success")
+        ctx.vault_exists = True
+    except Exception as exc:
+        flash(f"Ошибка создания вольта: {exc}", "error")
+    return None
+
+def _do_add_entry(ctx: _ActionContext) -> Optional[str]:
+    found = _require_site_login(ctx, "Укажите сайт и логин для создания записи.")
+    if found is None:
+        return None
+    site_id, login, key = found
+    if key in ctx.data["sites"]:
+        flash("Запись уже существует.", "warning")
+        return None
+    ctx.data["sites"][key] = {
+        "site_id": site_id,
+        "login": login,
+        "v": pwgen.ALGO_VERSION,
+        "c": 0,
+        "rseed": pwgen.random_bytes(16).hex(),
+        "kdf": pwgen.new_entry_kdf(),
+        "policy": dict(pwgen.PROFILES[ctx.profile]),
+        "created": pwgen.now_iso(),
+        "notes": "",
+    }
+    return "Запись создана."
+
+def _rotate(ctx: _ActionContext, new_rseed: bool) -> Optional[str]:
+    found = _require_entry(ctx, "Укажите сайт и логин для ротации.")
+    if found is None:
+        return None
+    entry = found[3]
+    if new_rseed:
+        entry["rseed"] = pwgen.random_bytes(16).hex()
+        entry["c"] = 0
+        msg = "Сгенерирован новый rseed и сброшен c=0"
+    else:
+        entry["c"] = int(entry.get("c", 0)) + 1
+        msg = f"Ротация выполнена: c={entry['c']}"
+    entry["v"] = pwgen.ALGO_VERSION
+    entry["kdf"] = pwgen.new_entry_kdf()
+    return msg
+
+def _do_rotate_c(ctx: _ActionContext) -> Optional[str]:
+    return _rotate(ctx, new_rseed=False)
+
+def _do_rotate_rseed(ctx: _ActionContext) -> Optional[str]:
+    return _rotate(ctx, new_rseed=True)
+
+def _do_generate(ctx: _ActionContext) -> Optional[str]:
+    found = _require_entry(ctx, "Укажите сайт и логин.")
+    if found is None:
+        return None
+    site_id, login, _, entry = found
+    policy = entry["policy"]
+    if ctx.length:
+        length = ctx.length.strip()
+        if not LENGTH_RE.match(length):
+            flash("Длина должна быть целым числом.", "error")
+        elif 4 <= int(length) <= 128:
+            policy = {**policy, "length": int(length)}
+        else:
+            flash("Длина должна быть 4..128.", "error")
+    capsule = pwgen.b64d(ctx.data["capsule"])
+    ctx.version = entry.get("v", pwgen.LEGACY_ALGO_VERSION)
+    stored_c = int(entry.get("c", 0))
+    try:
+        ctx.password, ctx.used_c = pwgen.gen_password_with_retries(
+            ctx.master, capsule, site_id, login,
+            policy, ctx.version, stored_c,
+            bytes.fromhex(entry["rseed"]),
+            kdf=entry.get("kdf"),
+        )
+        flash("Пароль сгенерирован.", "success")
+        if ctx.used_c != stored_c:
+            flash(
+                f"Для соответствия политике использован c={ctx.used_c} "
+                f"(в хранилище c={entry.get('c', 0)}).", "info"
+            )
+    except ValueError as exc:
+        flash(str(exc), "error")
+    return None
+
+def _do_list(ctx: _ActionContext) -> Optional[str]:
+    return None   # таблицу index() строит для всех действий, кроме generate
+
+_ACTIONS = {
+    "init_vault": _do_init_vault,
+    "add_entry": _do_add_entry,
+    "rotate_c": _do_rotate_c,
+    "rotate_rseed": _do_rotate_rseed,
+    "generate": _do_generate,
+    "list": _do_list,
+}
+# Действия, которые пишут вольт (создание или сохранение после обработчика)
+_MUTATING_ACTIONS = frozenset({"init_vault", "add_entry", "rotate_c", "rotate_rseed"})
+
 # ------------------------------------ Routes -----------------------------------
 
+# GET-страница не зависит от вольта (таблица и пароль — только в ответах на POST),
+# поэтому её ETag постоянен для процесса: повторный заход получает 304 без рендера
+_INDEX_GET_ETAG = hashlib.sha256("\0".join(
+    (HTML_TEMPLATE, STYLE_URL, SCRIPT_URL, _VAULT_PATH_STR, _PROFILE_OPTIONS["ultra"])
+).encode("utf-8")).hexdigest()[:16]
+
 @app.route("/", methods=["GET", "POST"])
 def index():
-    password = None
-    used_c = None
-    version = None
-    entries = []
-
-    site_field = request.form.get("site", "")
-    login_field = request.form.get("login", "")
-    length_field = request.form.get("length", "")
-    profile_field = request.form.get("profile", "ultra")
-    action = request.form.get("action", "generate")
-
-    profiles = list(pwgen.PROFILES.keys())
-    if profile_field not in profiles:
+    started = time.perf_counter()
+    # отложенные flash-сообщения меняют страницу — тогда рендерим как обычно
+    cacheable = request.method == "GET" and not session.get("_flashes")
+    if cacheable and _INDEX_GET_ETAG in request.if_none_match:
+        return Response(status=304, headers={"ETag": f'"{_INDEX_GET_ETAG}"', "Cache-Control": "no-cache"})
+    entries_html = ""
+
+    form = request.form
+    site_field = form.get("site", "")
+    login_field = form.get("login", "")
+    length_field = form.get("length", "")
+    profile_field = form.get("profile", "ultra")
+    action = form.get("action", "generate")
+
+    if profile_field not in pwgen.PROFILES:
         profile_field = "ultra"
 
-    vault_exists = VAULT_PATH.exists()
+    ctx = _ActionContext(form.get("master", ""), site_field, login_field, length_field, profile_field)
+    # Действия, которые сохраняют вольт, читают его по свежему stat: иначе они могут
+    # изменить версию 250-мс давности и затереть чужую запись. Остальным хватает TTL.
+    ctx.vault_exists = vault_stat(fresh=request.method == "POST" and action in _MUTATING_ACTIONS) is not None
 
     if request.method == "POST":
-        master = request.form.get("master", "")
-        if not master:
+        handler = _ACTIONS.get(action)   # неизвестное действие — только таблица
+        fields = (ctx.master, site_field, login_field, length_field)   # порядок FIELD_LIMITS
+        if any(len(value) > limit for value, (_, limit) in zip(fields, FIELD_LIMITS)):
+            flash("Слишком длинное значение в форме.", "error")
+        elif not ctx.master:
             flash("Введите мастер-пароль.", "error")
         else:
-            data = None
-            blob = None
-            if vault_exists:
+            if ctx.vault_exists:
                 try:
-                    blob, data = load_blob_and_plaintext(master)
+                    ctx.blob, ctx.data = load_blob_and_plaintext(ctx.master)
                 except Exception as exc:
-                    flash(f"Не удалось расшифровать {VAULT_PATH}: {exc}", "error")
+                    flash(f"Не удалось расшифровать {_VAULT_PATH_STR}: {exc}", "error")
 
-            if action == "init_vault":
-                if vault_exists:
-                    flash("Вольт уже существует.", "info")
-                else:
-                    try:
-                        capsule = pwgen.make_capsule("")
-                        pt = pwgen.make_empty_plaintext(pwgen.b64e(capsule))
-                        blob_new = pwgen.vault_encrypt(
-                            json.dumps(pt, ensure_ascii=False).encode("utf-8"),
-                            master,
-                            pwgen.DEFAULT_KDF_T,
-                            pwgen.DEFAULT_KDF_M,
-                            pwgen.DEFAULT_KDF_P,
-                        )
-                        pwgen.vault_save(str(VAULT_PATH), blob_new)
-                        flash("Вольт создан.", "success")
-                        vault_exists = True
-                        blob, data = load_blob_and_plaintext(master)
-                    except Exception as exc:
-                        flash(f"Ошибка создания вольта: {exc}", "error")
-
-            elif action == "add_entry":
-                if not data:
-                    flash("Сначала создайте вольт.", "error")
-                else:
-                    if not site_field or not login_field:
-                        flash("Укажите сайт и логин для создания записи.", "error")
-                    else:
-                        site_id = pwgen.normalize_site_id(site_field)
-                        key = f"{site_id}|{login_field.strip()}"
-                        if key in data["sites"]:
-                            flash("Запись уже существует.", "warning")
-                        else:
-                            policy = dict(pwgen.PROFILES[profile_field])
-                            data["sites"][key] = {
-                                "site_id": site_id,
-                                "login": login_field.strip(),
-                                "v": pwgen.ALGO_VERSION,
-                                "c": 0,
-                                "rseed": os.urandom(16).hex(),
-                                "policy": policy,
-                                "created": pwgen.now_iso(),
-                                "notes": "",
-                            }
-                            try:
-                                pwgen.write_plaintext(
-                                    str(VAULT_PATH), master, data,
-                                    blob["kdf"]["t"], blob["kdf"]["m"], blob["kdf"]["p"]
-                                )
-                                flash("Запись создана.", "success")
-                            except Exception as exc:
-                                flash(f"Ошибка сохранения: {exc}", "error")
-
-            elif action in ("rotate_c", "rotate_rseed"):
-                if not data:
-                    flash("Сначала создайте вольт.", "error")
-                else:
-                    if not site_field or not login_field:
-                        flash("Укажите сайт и логин для ротации.", "error")
-                    else:
-                        site_id = pwgen.normalize_site_id(site_field)
-                        key = f"{site_id}|{login_field.strip()}"
-                        entry = data["sites"].get(key)
-                        if not entry:
-                            flash("Такой пары сайт/логин нет в хранилище.", "error")
-                        else:
-                            if action == "rotate_c":
-                                entry["c"] = int(entry.get("c", 0)) + 1
-                                msg = f"Ротация выполнена: c={entry['c']}"
-                            else:
-                                entry["rseed"] = os.urandom(16).hex()
-                                entry["c"] = 0
-                                msg = "Сгенерирован новый rseed и сброшен c=0"
-                            entry["v"] = pwgen.ALGO_VERSION
-                            data["sites"][key] = entry
-                            try:
-                                pwgen.write_plaintext(
-                                    str(VAULT_PATH), master, data,
-                                    blob["kdf"]["t"], blob["kdf"]["m"], blob["kdf"]["p"]
-                                )
-                                flash(msg, "success")
-                            except Exception as exc:
-                                flash(f"Ошибка сохранения: {exc}", "error")
-
-            elif action in ("generate", "list"):
-                if not data:
+            if handler is not None:
+                if handler is not _do_init_vault and not ctx.data:
                     flash("Сначала создайте вольт.", "error")
                 else:
-                    entries = format_entries(data["sites"])
-                    if action == "generate":
-                        if not site_field or not login_field:
-                            flash("Укажите сайт и логин.", "error")
-                        else:
-                            site_id = pwgen.normalize_site_id(site_field)
-                            key = f"{site_id}|{login_field.strip()}"
-                            entry = data["sites"].get(key)
-                            if not entry:
-                                flash("Такой пары сайт/логин нет в хранилище.", "error")
-                            else:
-                                policy = entry["policy"]
-                                if length_field:
-                                    try:
-                                        override_len = int(length_field)
-                                        if 4 <= override_len <= 128:
-                                            policy = dict(policy); policy["length"] = override_len
-                                        else:
-                                            flash("Длина должна быть 4..128.", "error")
-                                    except ValueError:
-                                        flash("Длина должна быть целым числом.", "error")
-                                capsule = pwgen.b64d(data["capsule"])
-                                version = entry.get("v", pwgen.ALGO_VERSION)
-                                try:
-                                    password, used_c = pwgen.gen_password_with_retries(
-                                        master, capsule, site_id, login_field.strip(),
-                                        policy, version, int(entry.get("c", 0)),
-                                        bytes.fromhex(entry["rseed"]),
-                                    )
-                                    flash("Пароль сгенерирован.", "success")
-                                    if used_c != int(entry.get("c", 0)):
-                                        flash(
-                                            f"Для соответствия политике использован c={used_c} "
-                                            f"(в хранилище c={entry.get('c', 0)}).", "info"
-                                        )
-                                except ValueError as exc:
-                                    flash(str(exc), "error")
-
-            if data:
-                entries = format_entries(data["sites"])
-
-    context = {
-        "password": password,
-        "used_c": used_c,
-        "version": version,
-        "entries": entries,
-        "site": site_field,
-        "login": login_field,
-        "length_override": length_field,
-        "vault_path": VAULT_PATH,
-        "profiles": list(pwgen.PROFILES.keys()),
-        "profile": profile_field,
-        "theme_light": APP_THEME_LIGHT,
-        "theme_dark": APP_THEME_DARK,
-    }
-    return render_template_string(HTML_TEMPLATE, **context)
+                    msg = handler(ctx)
+                    if msg is not None:
+                        try:
+                            save_plaintext(ctx.master, ctx.data, ctx.blob)
+                            flash(msg, "success")
+                        except Exception as exc:
+                            flash(f"Ошибка сохранения: {exc}", "error")
+                            # ctx.data изменён, но не записан — в таблицу и её кэш он не идёт
+                            ctx.data = None
+
+            # Генерация таблицу не меняет — не перерисовываем её ради одного пароля
+            if ctx.data and action != "generate":
+                entries_html = cached_entries_html(ctx.data)
+
+    # Шаблону не нужны request/session/g из контекст-процессоров — рендерим напрямую
+    html = INDEX_TEMPLATE.render(
+        password=ctx.password,
+        used_c=ctx.used_c,
+        version=ctx.version,
+        entries_html=entries_html,
+        site=site_field,
+        login=login_field,
+        length_override=length_field,
+        vault_path=_VAULT_PATH_STR,
+        profile_options=_PROFILE_OPTIONS[profile_field],
+        css_url=STYLE_URL,
+        js_url=SCRIPT_URL,
+    )
+    _observe_latency(action if request.method == "POST" else "GET", started)
+    if cacheable:
+        response = Response(html, mimetype="text/html", headers={"Cache-Control": "no-cache"})
+        response.set_etag(_INDEX_GET_ETAG)
+        return response
+    if ctx.password is None:
+        return html
+    # Страница с паролем не должна оседать в HTTP-кэше и bfcache браузера
+    return Response(html, mimetype="text/html", headers={"Cache-Control": "no-store"})
 
 # ----------------------------------- PWA stuff ----------------------------------
 
-@app.route("/manifest.webmanifest")
-def manifest_webmanifest():
-    manifest = {
-        "name": APP_NAME,
-        "short_name": "pwgen",
-        "start_url": "/",
-        "display": "standalone",
-        "background_color": APP_THEME_DARK,
-        "theme_color": APP_THEME_DARK,
-        "icons": [
-            {"src": "/icon.svg", "sizes": "any", "type": "image/svg+xml", "purpose": "any maskable"}
-        ]
-    }
-    return Response(json.dumps(manifest), mimetype="application/manifest+json")
-
-
-@app.route("/icon.svg")
-def icon_svg():
-    svg = f'''<svg xmlns="http://www.w3.org/2000/svg" width="512" height="512">
+# PWA-ответы постоянны — тела и ETag считаются один раз при импорте
+MANIFEST_JSON = pwgen.json_dumps_bytes({
+    "name": APP_NAME,
+    "short_name": "pwgen",
+    "start_url": "/",
+    "display": "standalone",
+    "background_color": APP_THEME_DARK,
+    "theme_color": APP_THEME_DARK,
+    "icons": [
+        {"src": "/icon.svg", "sizes": "any", "type": "image/svg+xml", "purpose": "any maskable"}
+    ]
+})
+
+ICON_SVG = '''<svg xmlns="http://www.w3.org/2000/svg" width="512" height="512">
       <defs>
         <linearGradient id="g" x1="0" x2="1" y1="0" y2="1">
           <stop offset="0%" stop-color="#22d3ee"/><stop offset="100%" stop-color="#6366f1"/>
@@ -570,15 +958,12 @@ def icon_svg():
       <g fill="white" font-family="Inter, system-ui, sans-serif" font-weight="800" font-size="220">
         <text x="86" y="300">pw</text>
       </g>
-    </svg>'''
-    return Response(svg, mimetype="image/svg+xml")
+    </svg>'''.encode("utf-8")
 
-
-@app.route("/sw.js")
-def service_worker():
-    js = """const CACHE='pwgen-shell-v3';
+_SW_SHELL = json.dumps(["/", "/manifest.webmanifest", "/icon.svg", STYLE_URL, SCRIPT_URL])
+SERVICE_WORKER_JS = ("""const CACHE='pwgen-shell-v5';
 self.addEventListener('install',e=>{
-  e.waitUntil(caches.open(CACHE).then(c=>c.addAll(['/','/manifest.webmanifest','/icon.svg'])));
+  e.waitUntil(caches.open(CACHE).then(c=>c.addAll(""" + _SW_SHELL + """)));
 });
 self.addEventListener('activate',e=>{
   e.waitUntil(caches.keys().then(keys=>Promise.all(keys.filter(k=>k!==CACHE).map(k=>caches.delete(k)))));
@@ -593,12 +978,65 @@ self.addEventListener('fetch',e=>{
     return;
   }
   e.respondWith(caches.match(e.request).then(m=> m || fetch(e.request)));
-});"""
-    return Response(js, mimetype="application/javascript", headers={"Cache-Control":"no-cache"})
+});""").encode("utf-8")
+
+PWA_CACHE_CONTROL = "public, max-age=86400"
+_ETAGS = {body: hashlib.sha256(body).hexdigest()[:16] for body in (MANIFEST_JSON, ICON_SVG, SERVICE_WORKER_JS)}
+
+def _static_response(body: bytes, mimetype: str, cache_control: str) -> Response:
+    """Готовое тело с ETag; на совпавший If-None-Match — 304 без тела."""
+    response = Response(body, mimetype=mimetype, headers={"Cache-Control": cache_control})
+    response.set_etag(_ETAGS[body])
+    return response.make_conditional(request)
+
+
+@app.route("/manifest.webmanifest")
+def manifest_webmanifest():
+    return _static_response(MANIFEST_JSON, "application/manifest+json", PWA_CACHE_CONTROL)
+
+
+@app.route("/icon.svg")
+def icon_svg():
+    return _static_response(ICON_SVG, "image/svg+xml", PWA_CACHE_CONTROL)
+
+
+def _asset_response(body: str, body_gz: bytes, mimetype: str) -> Response:
+    headers = {"Cache-Control": ASSET_CACHE_CONTROL, "Vary": "Accept-Encoding"}
+    if request.accept_encodings["gzip"]:
+        headers["Content-Encoding"] = "gzip"
+        return Response(body_gz, mimetype=mimetype, headers=headers)
+    return Response(body, mimetype=mimetype, headers=headers)
+
+
+@app.route("/pwgen.css")
+def stylesheet():
+    return _asset_response(STYLE_CSS, _STYLE_CSS_GZ, "text/css")
+
+
+@app.route("/pwgen.js")
+def script():
+    return _asset_response(SCRIPT_JS, _SCRIPT_JS_GZ, "application/javascript")
+
+
+@app.route("/sw.js")
+def service_worker():
+    # no-cache: браузер должен перепроверять воркер при каждой регистрации (ETag даёт 304)
+    return _static_response(SERVICE_WORKER_JS, "application/javascript", "no-cache")
+
+if METRICS_ENABLED:
+    @app.route("/metrics")
+    def metrics():
+        if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+            # гистограммы всех воркеров gunicorn, а не только того, кто принял scrape
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+            return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+        return Response(generate_latest(), content_type=CONTENT_TYPE_LATEST)
 
 # ------------------------------------ Main --------------------------------------
 
 if __name__ == "__main__":
+    # Только для локальной отладки; в проде — gunicorn по Procfile.
     host = os.environ.get("PWGEN_WEB_HOST", "0.0.0.0")
     port = int(os.environ.get("PWGEN_WEB_PORT", os.environ.get("PORT", "5000")))
     app.run(host=host, port=port, debug=False)